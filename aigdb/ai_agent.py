@@ -1,12 +1,29 @@
-from typing import Callable, List
-
+import hashlib
+import json
+import re
+from functools import wraps
+from typing import Any, Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain.tools import StructuredTool, tool
+from langchain.tools import tool
 from pydantic import BaseModel, Field
 
 from .config import get_llm
-from .gdb_controller import GDBController
+from .gdb_controller import DANGEROUS_CLI_RE, GDBController
+
+
+# 单次工具输出上限（字符），超出部分按引用留存，模型可通过show_section分段读取
+TOOL_OUTPUT_MAX_CHARS = 8000
+
+
+def _truncate(out: str, ref: str, max_chars: int = TOOL_OUTPUT_MAX_CHARS) -> str:
+    return (
+        out[:max_chars]
+        + f"\n...[truncated, {len(out) - max_chars} chars; call show_section(ref={ref}) to fetch more]"
+    )
 
 
 class LoadCoreInput(BaseModel):
@@ -41,10 +58,77 @@ class DisassembleInput(BaseModel):
     count: int = Field(32, description="反汇编条目数量，1-256")
 
 
-def build_agent(gdb: GDBController, on_gdb_log: Callable[[str], None]) -> AgentExecutor:
+class ShowSectionInput(BaseModel):
+    ref: str = Field(..., description="被截断输出的引用ID")
+    start: int = Field(0, description="起始字符偏移")
+    length: int = Field(TOOL_OUTPUT_MAX_CHARS, description=f"读取字符数，最多{TOOL_OUTPUT_MAX_CHARS}")
+
+
+# 切换线程/栈帧的原生命令：执行后查看类工具的输出会变化，需清零重复计数
+_CONTEXT_SWITCH_RE = re.compile(r"^(thread|frame|f|up|down|select-frame)\b", re.IGNORECASE)
+
+
+class DedupCritic(BaseCallbackHandler):
+    """拦截同一次智能体运行内参数完全相同的重复工具调用，避免模型在工具循环中原地打转。
+    每次顶层运行开始时清零计数并调用on_run_start；切换线程/栈帧会改变上下文，由调用方显式reset。
+    """
+
+    def __init__(self, limit: int = 2, on_run_start: Optional[Callable[[], None]] = None) -> None:
+        self.limit = limit
+        self.on_run_start = on_run_start
+        self.counts: Dict[Tuple[str, str], int] = {}
+
+    def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        if parent_run_id is None:
+            self.reset()
+            if self.on_run_start is not None:
+                self.on_run_start()
+
+    def reset(self) -> None:
+        self.counts.clear()
+
+    def check(self, name: str, **args: Any) -> str:
+        """记录一次调用；达到上限时返回给模型的纠正提示，否则返回空串。"""
+        digest = hashlib.sha1(json.dumps(args, sort_keys=True, default=str).encode()).hexdigest()
+        key = (name, digest)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if self.counts[key] >= self.limit:
+            return f"重复调用已阻止：{name} 已用相同参数执行过，请直接使用之前的输出或改用其他工具。"
+        return ""
+
+
+# 系统提示保持精简且不含时间戳等动态内容
+AGENT_RULES = (
+    "未加载core先load_core；先看thread_info、bt/bt_full与信号。\n"
+    "需要时select_thread/select_frame，再看registers、disassemble、memory_read。\n"
+    "每次只调用一个必要工具，读完输出再决定下一步。"
+)
+AGENT_DIRECTIVE = "你是Linux崩溃排查助手，用GDB工具取证，最终给出结论、证据与修复建议。"
+
+
+def build_agent(
+    gdb: GDBController,
+    on_gdb_log: Callable[[str], None],
+    max_iterations: int = 12,
+) -> AgentExecutor:
     """构建LangChain智能体，将GDB操作包装为工具供模型调用。"""
 
+    # 被截断输出的完整文本：ref -> text
+    blobs: Dict[str, str] = {}
+
     def _log_and_return(tag: str, text: str) -> str:
+        if len(text) > TOOL_OUTPUT_MAX_CHARS:
+            ref = f"{tag}-{len(blobs) + 1}"
+            blobs[ref] = text
+            text = _truncate(text, ref)
         on_gdb_log(f"[{tag}]\n{text}\n")
         return text
 
@@ -64,143 +148,157 @@ def build_agent(gdb: GDBController, on_gdb_log: Callable[[str], None]) -> AgentE
             on_gdb_log(f"[restore]\n{restore_out}\n")
         return ""
 
-    def _safe_call(tag: str, fn) -> str:
-        try:
-            out = fn()
-            return _log_and_return(tag, out)
-        except Exception as e:
-            on_gdb_log(f"[error]\n{e}\n")
-            return f"(error: {e})"
+    # 截断原文只在本次运行内可取回，顶层运行开始时清空，避免长会话中无限累积
+    critic = DedupCritic(on_run_start=blobs.clear)
+
+    def _precheck(name: str, **args: Any) -> str:
+        msg = critic.check(name, **args)
+        if msg:
+            on_gdb_log(f"[blocked]\n{msg}\n")
+            return msg
+        return _ensure_loaded()
+
+    def safe_tool(tag: str, name: Optional[str] = None):
+        """工具体装饰器：先做重复调用与加载状态预检，再统一记录输出并兜底异常。
+        name为去重使用的工具名，缺省与日志标签tag相同。
+        """
+        def deco(fn):
+            @wraps(fn)
+            def wrapper(*args: Any, **kwargs: Any) -> str:
+                msg = _precheck(name or tag, **kwargs)
+                if msg:
+                    return msg
+                try:
+                    return _log_and_return(tag, fn(*args, **kwargs))
+                except Exception as e:
+                    on_gdb_log(f"[error]\n{e}\n")
+                    return f"(error: {e})"
+            return wrapper
+        return deco
 
     # LangChain @tool 风格重构：每个工具以装饰器定义，自动生成Schema
     @tool("load_core", args_schema=LoadCoreInput)
     def tool_load_core(exe_path: str, core_path: str) -> str:
         """加载core文件与可执行文件。"""
+        msg = critic.check("load_core", exe_path=exe_path, core_path=core_path)
+        if msg:
+            return msg
         out = gdb.load_core(exe_path, core_path)
+        critic.reset()
+        blobs.clear()
         return _log_and_return("load_core", out)
 
     @tool("run_gdb", args_schema=RunGdbInput)
     def tool_run_gdb(command: str) -> str:
         """运行原生GDB命令，自动阻断破坏性命令。"""
-        msg = _ensure_loaded()
+        msg = _precheck("run_gdb", command=command)
         if msg:
             return msg
-        cmd_norm = command.strip().lower()
-        dangerous_prefixes = [
-            "file", "core-file", "symbol-file", "exec-file",
-            "target", "attach", "run", "quit",
-        ]
-        if any(cmd_norm.startswith(p) for p in dangerous_prefixes):
+        if DANGEROUS_CLI_RE.match(command.strip()):
             on_gdb_log(f"[blocked]\n阻止执行可能破坏上下文的命令：{command}\n")
             return "命令已阻止：可能清空或改变当前可执行/核心文件上下文。请改用 info/print/bt/x 等查看类命令。"
         out = gdb.run_cli(command)
+        if _CONTEXT_SWITCH_RE.match(command.strip()):
+            critic.reset()
         return _log_and_return("gdb", out)
 
     @tool("backtrace", args_schema=StackInput)
+    @safe_tool("backtrace")
     def tool_bt(thread_id: int) -> str:
         """查看指定线程调用栈。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        out = gdb.stack_list_frames(thread_id=thread_id)
-        return _log_and_return("backtrace", out)
+        return gdb.stack_list_frames(thread_id=thread_id)
 
     @tool("list_locals")
+    @safe_tool("locals", "list_locals")
     def tool_locals() -> str:
         """列出当前栈帧的局部变量。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        out = gdb.stack_list_locals(all_values=True)
-        return _log_and_return("locals", out)
+        return gdb.stack_list_locals(all_values=True)
 
     @tool("select_thread", args_schema=SelectThreadInput)
+    @safe_tool("select_thread")
     def tool_select_thread(thread_id: int) -> str:
         """选择线程上下文。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        return _safe_call("select_thread", lambda: gdb.select_thread(thread_id))
+        # 上下文切换后，同名查看类工具的输出可能不同，清零重复计数
+        critic.reset()
+        return gdb.select_thread(thread_id)
 
     @tool("select_frame", args_schema=SelectFrameInput)
+    @safe_tool("select_frame")
     def tool_select_frame(level: int) -> str:
         """选择栈帧层级。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        return _safe_call("select_frame", lambda: gdb.select_frame(level))
+        critic.reset()
+        return gdb.select_frame(level)
 
     @tool("registers")
+    @safe_tool("registers")
     def tool_registers() -> str:
         """查看当前寄存器状态。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        return _safe_call("registers", gdb.get_registers)
+        return gdb.get_registers()
 
     @tool("disassemble", args_schema=DisassembleInput)
+    @safe_tool("disassemble")
     def tool_disassemble(count: int) -> str:
         """反汇编PC附近若干指令。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        return _safe_call("disassemble", lambda: gdb.disassemble_current(count))
+        return gdb.disassemble_current(count)
 
     @tool("memory_read", args_schema=MemoryReadInput)
+    @safe_tool("memory", "memory_read")
     def tool_memory_read(addr: str, count: int, fmt: str) -> str:
         """读取指定地址的内存块。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        return _safe_call("memory", lambda: gdb.memory_read(addr, count, fmt))
+        return gdb.memory_read(addr, count, fmt)
 
     @tool("info_files")
+    @safe_tool("info_files")
     def tool_info_files() -> str:
         """查看当前映射/符号文件信息。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        return _safe_call("info_files", gdb.info_files)
+        return gdb.info_files()
 
     @tool("sharedlibs")
+    @safe_tool("sharedlibs")
     def tool_sharedlibs() -> str:
         """查看已加载的共享库信息。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        return _safe_call("sharedlibs", gdb.info_sharedlibrary)
+        return gdb.info_sharedlibrary()
 
     @tool("bt_full")
+    @safe_tool("bt_full")
     def tool_bt_full() -> str:
         """查看完整调用栈（包含参数与局部信息）。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        return _safe_call("bt_full", gdb.bt_full)
+        return gdb.bt_full()
 
     @tool("info_args")
+    @safe_tool("info_args")
     def tool_info_args() -> str:
         """查看当前函数参数。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        return _safe_call("info_args", gdb.info_args)
+        return gdb.info_args()
 
     @tool("info_locals")
+    @safe_tool("info_locals")
     def tool_info_locals() -> str:
         """查看当前帧局部变量。"""
-        msg = _ensure_loaded()
-        if msg:
-            return msg
-        return _safe_call("info_locals", gdb.info_locals)
+        return gdb.info_locals()
 
     @tool("thread_info")
+    @safe_tool("thread_info")
     def tool_thread_info() -> str:
         """查看线程信息。"""
-        msg = _ensure_loaded()
+        return gdb.thread_info()
+
+    @tool("show_section", args_schema=ShowSectionInput)
+    def tool_show_section(ref: str, start: int = 0, length: int = TOOL_OUTPUT_MAX_CHARS) -> str:
+        """分段读取此前被截断的工具输出。"""
+        msg = critic.check("show_section", ref=ref, start=start, length=length)
         if msg:
             return msg
-        return _safe_call("thread_info", gdb.thread_info)
+        blob = blobs.get(ref)
+        if blob is None:
+            return f"未找到引用：{ref}"
+        start = max(0, start)
+        end = start + max(1, min(length, TOOL_OUTPUT_MAX_CHARS))
+        section = blob[start:end]
+        if end < len(blob):
+            section += f"\n...[剩余{len(blob) - end}字符，可用start={end}继续读取]"
+        on_gdb_log(f"[show_section {ref}]\n{section}\n")
+        return section
 
     # 使用装饰器生成的工具对象集合
     tools = [
@@ -219,18 +317,15 @@ def build_agent(gdb: GDBController, on_gdb_log: Callable[[str], None]) -> AgentE
         tool_info_args,
         tool_info_locals,
         tool_thread_info,
+        tool_show_section,
     ]
 
     llm = get_llm()
 
+    # 规则在前、指令在后，两条system消息均为固定文本，保证每轮请求前缀逐字节一致以命中DeepSeek前缀缓存
     prompt = ChatPromptTemplate.from_messages([
-        ("system", "你是一个资深Linux崩溃排查助手。你可以通过工具操作GDB收集信息，并基于证据做出推断与建议。\n"
-                   "工作流：\n"
-                   "1) 若未加载core，先使用load_core。\n"
-                   "2) 先获取thread_info、bt/bt_full、signal与program状态；\n"
-                   "3) 必要时select_thread/select_frame，查看registers、disassemble、memory_read；\n"
-                   "4) 汇总发现与因果链，提出修复建议与定位方法。\n"
-                   "规则：每次只调用一个最必要的工具；读完输出后再决定下一步；最终给出清晰结论、证据列表与建议。"),
+        ("system", AGENT_RULES),
+        ("system", AGENT_DIRECTIVE),
         ("human", "{input}"),
         ("placeholder", "{agent_scratchpad}"),
     ])
@@ -242,7 +337,10 @@ def build_agent(gdb: GDBController, on_gdb_log: Callable[[str], None]) -> AgentE
         agent=agent,
         tools=tools,
         verbose=False,
-        max_iterations=12,
+        max_iterations=max_iterations,
+        callbacks=[critic],
         handle_parsing_errors="工具解析失败，请重试或调整指令。",
         return_intermediate_steps=True,
+        # 走invoke路径才会查询/写入LLM缓存；streaming=True时token仍经on_llm_new_token流出
+        stream_runnable=False,
     )
\ No newline at end of file
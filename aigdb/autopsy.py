@@ -1,3 +1,4 @@
+import asyncio
 from typing import Callable
 
 from .gdb_controller import GDBController
@@ -16,11 +17,19 @@ class AutoAnalyzer:
         self.on_gdb_log(f"[{tag}]\n{text}\n")
         return text
 
-    def collect(self) -> str:
-        chunks = []
-        chunks.append(self._log("thread_info", self.gdb.thread_info()))
-        chunks.append(self._log("signal", self.gdb.get_signal_summary()))
-        # 采集主线程调用栈（尝试选择当前停止线程）
-        chunks.append(self._log("bt", self.gdb.stack_list_frames(thread_id=None)))
-        chunks.append(self._log("locals", self.gdb.stack_list_locals(all_values=True)))
+    async def collect(self) -> str:
+        # 四项采样互不依赖：并发提交给GDB的I/O线程，由其合并写入并按token分发结果
+        ti, sig, bt, loc = await asyncio.gather(
+            self.gdb.thread_info_async(),
+            self.gdb.get_signal_summary_async(),
+            # 采集主线程调用栈（尝试选择当前停止线程）
+            self.gdb.stack_list_frames_async(None),
+            self.gdb.stack_list_locals_async(True),
+        )
+        chunks = [
+            self._log("thread_info", ti),
+            self._log("signal", sig),
+            self._log("bt", bt),
+            self._log("locals", loc),
+        ]
         return "\n\n".join(chunks)
\ No newline at end of file
@@ -1,5 +1,7 @@
 import asyncio
-from typing import List
+import mmap
+import threading
+from typing import List, Tuple
 
 from prompt_toolkit.application import Application
 from prompt_toolkit.buffer import Buffer
@@ -9,25 +11,161 @@ from prompt_toolkit.layout.controls import BufferControl
 from prompt_toolkit.styles import Style
 from prompt_toolkit.document import Document
 from prompt_toolkit.key_binding import KeyBindings
+from langchain.agents import AgentExecutor
 from .gdb_controller import GDBController
 from .ai_agent import build_agent
 from .autopsy import AutoAnalyzer
+from .config import semantic_lookup, semantic_scope, semantic_store
 from prompt_toolkit.widgets import Frame
 from datetime import datetime
-import textwrap
+
+
+# 日志环容量与渲染窗口（约400行×80列）
+LOG_RING_BYTES = 1 << 20
+LOG_WINDOW_BYTES = 80 * 400
+
+# 分析/汇总的固定输入模板，调用时只做format填充
+_ANALYZE_INPUT_TMPL = (
+    "上下文已加载：exe_path={exe}, core_path={core}。"
+    "你应先调用 thread_info 与 bt/bt_full 验证上下文，然后根据需要 select_thread/select_frame、registers、disassemble、memory_read。"
+    "不要再次调用 load_core 或任何会更改目标的命令。现在开始分析。"
+)
+_COLLECT_INPUT_TMPL = "以下是采集到的关键信息，请根据证据进行总结与建议：\n\n{collected}"
+
+_now = datetime.now
+
+
+def _ts() -> str:
+    return _now().strftime('%H:%M:%S')
+
+
+class RingLog:
+    """基于匿名mmap的定长环形日志：追加只做O(1)字节写入，渲染时只解码尾部窗口，
+    长时间会话的渲染开销不随日志总量增长；超出环容量的最旧内容被覆盖。
+    支持读取与改写最后一条（流式输出续写），并记录自上次渲染以来的追加增量。
+    工具线程与事件循环会同时访问，所有读写都在锁内完成。
+    """
+
+    def __init__(self, size: int = LOG_RING_BYTES) -> None:
+        self._mm = mmap.mmap(-1, size)
+        self._size = size
+        self._lock = threading.Lock()
+        # 累计写入字节数（绝对位置），对size取模得到环内偏移
+        self._pos = 0
+        # 仍有效的最早绝对位置：更早的字节已被环绕写入覆盖
+        self._floor = 0
+        self._last = ""
+        self._last_start = 0
+        self.seq = 0
+        self._delta: List[str] = []
+        self._delta_bytes = 0
+        # 面板中当前已显示的字节数，与LOG_WINDOW_BYTES同单位比较
+        self._shown_bytes = 0
+        self._rebuild = True
+
+    def _write(self, data: bytes) -> None:
+        data = data[-self._size:]
+        off = self._pos % self._size
+        first = min(len(data), self._size - off)
+        self._mm[off:off + first] = data[:first]
+        if first < len(data):
+            self._mm[:len(data) - first] = data[first:]
+        self._pos += len(data)
+        self._floor = max(self._floor, self._pos - self._size)
+
+    def _push_delta(self, text: str, data: bytes) -> None:
+        self._delta.append(text)
+        self._delta_bytes += len(data)
+
+    def append(self, item: str) -> None:
+        with self._lock:
+            sep = "\n" if self._pos else ""
+            self._write(sep.encode())
+            self._last_start = self._pos
+            data = item.encode()
+            self._write(data)
+            self._last = item
+            self._push_delta(sep + item, data + sep.encode())
+            self.seq += 1
+
+    def __getitem__(self, index: int) -> str:
+        if index != -1:
+            raise IndexError("RingLog only supports the last entry")
+        return self._last
+
+    def __setitem__(self, index: int, item: str) -> None:
+        with self._lock:
+            old = self[index]
+            if item.startswith(old):
+                # 流式输出只在末尾续写：仅写入新增后缀，单个token为O(1)
+                suffix = item[len(old):]
+                data = suffix.encode()
+                self._write(data)
+                self._push_delta(suffix, data)
+            else:
+                # 其余改写回退到条目起点整条重写，并整段重建
+                self._pos = self._last_start
+                self._write(item.encode())
+                self._rebuild = True
+            self._last = item
+            self.seq += 1
+
+    def tail(self, nbytes: int = LOG_WINDOW_BYTES) -> str:
+        """解码最近nbytes字节；窗口从行中间开始时丢弃首个不完整行。"""
+        with self._lock:
+            return self._tail(nbytes)
+
+    def _tail(self, nbytes: int) -> str:
+        n = min(nbytes, self._pos - self._floor)
+        end = self._pos % self._size
+        start = (end - n) % self._size
+        if start < end or n == 0:
+            raw = self._mm[start:end]
+        else:
+            raw = self._mm[start:] + self._mm[:end]
+        text = raw.decode("utf-8", errors="ignore")
+        before = self._pos - n - 1
+        if n < self._pos and not (before >= self._floor and self._mm[before % self._size] == ord("\n")):
+            text = text.partition("\n")[2]
+        self._shown_bytes = n
+        return text
+
+    def take_update(self) -> Tuple[int, bool, str]:
+        """原子地取出渲染更新：返回(seq, 是否整段替换, 文本)。
+        需要重建或面板内容加增量超出窗口时返回尾部窗口全文，否则返回自上次以来的增量。
+        """
+        with self._lock:
+            full = self._rebuild or self._shown_bytes + self._delta_bytes > LOG_WINDOW_BYTES
+            if full:
+                text = self._tail(LOG_WINDOW_BYTES)
+            else:
+                text = "".join(self._delta)
+                self._shown_bytes += self._delta_bytes
+            self._rebuild = False
+            self._delta.clear()
+            self._delta_bytes = 0
+            return self.seq, full, text
 
 
 class CLIApp:
     def __init__(self) -> None:
         self.gdb = GDBController()
-        self.gdb_log: List[str] = []
-        self.ai_log: List[str] = []
+        self.gdb_log = RingLog()
+        self.ai_log = RingLog()
+        # 上次渲染时两个日志的seq，未变化则跳过重绘
+        self._gdb_render_seq = -1
+        self._ai_render_seq = -1
+        self._input_lock = asyncio.Lock()
 
         def on_gdb_log(text: str) -> None:
+            # 可能在工具线程中调用：只写日志并请求重绘，缓冲区由事件循环在after_render中更新
             self.gdb_log.append(text)
-            self.refresh_views()
+            self.app.invalidate()
 
         self.agent = build_agent(self.gdb, on_gdb_log)
+        # 分步分析与纯汇总使用更小的迭代上限，共享同一套工具与去重回调
+        self.analyze_agent = self.agent.model_copy(update={"max_iterations": 6})
+        self.collect_agent = self.agent.model_copy(update={"max_iterations": 3})
         self.autopsy = AutoAnalyzer(self.gdb, on_gdb_log)
 
         # 输入缓冲区：单行，按 Enter 发送
@@ -101,85 +239,114 @@ class CLIApp:
         self.input_buffer.accept_handler = self.on_enter
 
     def refresh_views(self, *_) -> None:
-        self.gdb_buffer.set_document(Document("\n".join(self.gdb_log[-400:])), bypass_readonly=True)
-        self.ai_buffer.set_document(Document("\n".join(self.ai_log[-400:])), bypass_readonly=True)
+        if self.gdb_log.seq != self._gdb_render_seq:
+            self._gdb_render_seq = self._render_log(self.gdb_log, self.gdb_buffer)
+        if self.ai_log.seq != self._ai_render_seq:
+            self._ai_render_seq = self._render_log(self.ai_log, self.ai_buffer)
         # 默认保持输入行聚焦，确保键入有响应
         try:
             self.app.layout.focus(self.input_buffer)
         except Exception:
             pass
 
+    @staticmethod
+    def _render_log(log: RingLog, buf: Buffer) -> int:
+        # 仅追加且未超出窗口时只写入增量，否则从环形日志解码尾部窗口；返回已渲染到的seq
+        seq, full, text = log.take_update()
+        if not full:
+            if not text:
+                return seq
+            text = buf.text + text
+        buf.set_document(Document(text), bypass_readonly=True)
+        return seq
+
     async def handle_user_text(self, text: str) -> None:
         text = text.strip()
         if not text:
             return
+        # on_enter会并发触发本函数；流式输出依赖"本次条目始终是ai_log最后一条"，故串行处理每条输入
+        async with self._input_lock:
+            await self._dispatch(text)
+        self.refresh_views()
+
+    async def _dispatch(self, text: str) -> None:
         # 命令分派
         if text.startswith("/load "):
             try:
                 _, exe, core = text.split(maxsplit=2)
-                out = self.gdb.load_core(exe, core)
+                out = await asyncio.to_thread(self.gdb.load_core, exe, core)
                 self.gdb_log.append(f"[load_core]\n{out}\n")
             except Exception as e:
                 self.ai_log.append(self.format_ai_text(f"载入失败：{e}"))
         elif text.startswith("/cmd "):
             cmd = text[len("/cmd ") :]
-            out = self.gdb.run_cli(cmd)
-            self.gdb_log.append(f"[GDB {datetime.now().strftime('%H:%M:%S')}]\n{out}\n")
-        elif text.strip() == "/analyze":
-            # 让AI按工作流自行调用工具，分步分析
-            # 预检是否已加载上下文，未加载则提示并返回
-            if not self.gdb.verify_loaded():
-                self.ai_log.append(self.format_ai_text("尚未加载core，请先使用 /load <exe> <core> 进行加载。"))
-                self.refresh_views()
-                return
-            # 提供当前上下文与状态，减少模型误判再去调用load_core
-            info = self.gdb.info_files()
-            self.gdb_log.append(f"[info_files {datetime.now().strftime('%H:%M:%S')}]\n{info}\n")
-            self.ai_log.append(self.format_ai_text("开始自动分析，请稍候…"))
-            result = await self.agent.ainvoke({
-                "input": (
-                    f"上下文已加载：exe_path={self.gdb.exe_path}, core_path={self.gdb.core_path}。"\
-                    "你应先调用 thread_info 与 bt/bt_full 验证上下文，然后根据需要 select_thread/select_frame、registers、disassemble、memory_read。"\
-                    "不要再次调用 load_core 或任何会更改目标的命令。现在开始分析。"
-                ),
-            })
-            self.ai_log.append(self.format_ai_text(str(result.get("output", "(no output)"))))
-        elif text.strip() == "/analyse":
-            # 英式拼写兼容，同步触发分步分析
-            # 预检是否已加载上下文，未加载则提示并返回
-            if not self.gdb.verify_loaded():
-                self.ai_log.append(self.format_ai_text("尚未加载core，请先使用 /load <exe> <core> 进行加载。"))
-                self.refresh_views()
-                return
-            # 提供当前上下文与状态，减少模型误判再去调用load_core
-            info = self.gdb.info_files()
-            self.gdb_log.append(f"[info_files {datetime.now().strftime('%H:%M:%S')}]\n{info}\n")
-            self.ai_log.append(self.format_ai_text("开始自动分析，请稍候…"))
-            result = await self.agent.ainvoke({
-                "input": (
-                    f"上下文已加载：exe_path={self.gdb.exe_path}, core_path={self.gdb.core_path}。"\
-                    "你应先调用 thread_info 与 bt/bt_full 验证上下文，然后根据需要 select_thread/select_frame、registers、disassemble、memory_read。"\
-                    "不要再次调用 load_core 或任何会更改目标的命令。现在开始分析。"
-                ),
-            })
-            self.ai_log.append(self.format_ai_text(str(result.get("output", "(no output)"))))
-
-        elif text.strip() == "/collect":
-            collected = self.autopsy.collect()
+            out = await self.gdb.arun_cli(cmd)
+            self.gdb_log.append(f"[GDB {_ts()}]\n{out}\n")
+        elif text in ("/analyze", "/analyse"):
+            # 英式拼写兼容：两种写法都触发AI按工作流分步分析
+            await self._run_analysis()
+        elif text == "/collect":
+            collected = await self.autopsy.collect()
             self.ai_log.append(self.format_ai_text("采样完成，正在汇总…"))
-            result = await self.agent.ainvoke({
-                "input": f"以下是采集到的关键信息，请根据证据进行总结与建议：\n\n{collected}",
-            })
-            self.ai_log.append(self.format_ai_text(str(result.get("output", "(no output)"))))
+            await self.stream_agent(self.collect_agent, _COLLECT_INPUT_TMPL.format(collected=collected))
         else:
-            # 普通自然语言交互
-            result = await self.agent.ainvoke({"input": text})
-            self.ai_log.append(self.format_ai_text(str(result["output"])))
-        self.refresh_views()
+            # 普通自然语言交互：已加载core时先按原始提问查语义缓存（按exe/core分区），未命中再运行智能体
+            scope = semantic_scope(self.gdb.exe_path, self.gdb.core_path)
+            if scope is not None:
+                cached = await asyncio.to_thread(semantic_lookup, scope, text)
+                if cached:
+                    self.ai_log.append(self.format_ai_text(cached))
+                    return
+            answer = await self.stream_agent(self.agent, text)
+            # 运行中智能体可能自行load_core切换了目标，此时回答不属于原分区，不入缓存
+            if scope is not None and scope == semantic_scope(self.gdb.exe_path, self.gdb.core_path):
+                await asyncio.to_thread(semantic_store, scope, text, answer)
+
+    async def _run_analysis(self) -> None:
+        # 预检与上下文信息互不依赖：并发提交，GDB I/O线程会合并为一次写入
+        loaded, info = await asyncio.gather(
+            asyncio.to_thread(self.gdb.verify_loaded),
+            asyncio.to_thread(self.gdb.info_files),
+        )
+        # 未加载则提示并返回
+        if not loaded:
+            self.ai_log.append(self.format_ai_text("尚未加载core，请先使用 /load <exe> <core> 进行加载。"))
+            return
+        # 提供当前上下文与状态，减少模型误判再去调用load_core
+        self.gdb_log.append(f"[info_files {_ts()}]\n{info}\n")
+        self.ai_log.append(self.format_ai_text("开始自动分析，请稍候…"))
+        await self.stream_agent(
+            self.analyze_agent,
+            _ANALYZE_INPUT_TMPL.format(exe=self.gdb.exe_path, core=self.gdb.core_path),
+        )
+
+    async def stream_agent(self, agent: AgentExecutor, input_text: str) -> str:
+        """以事件流方式运行智能体：token实时追加到AI面板，工具完成时在GDB面板打标记。返回最终回答。"""
+        answer = ""
+        self.ai_log.append(f"[AI {_ts()}]\n")
+        async for ev in agent.astream_events({"input": input_text}, version="v2"):
+            kind = ev["event"]
+            if kind == "on_chat_model_stream":
+                content = ev["data"]["chunk"].content
+                if content:
+                    self.ai_log[-1] += content
+                    self.refresh_views()
+            elif kind == "on_tool_end":
+                self.gdb_log.append(f"[tool:{ev['name']}]")
+                self.refresh_views()
+            elif kind == "on_chain_end" and not ev.get("parent_ids"):
+                # 顶层链结束：流式草稿含各轮工具调用前的叙述，统一替换为智能体的最终回答
+                output = ev["data"].get("output")
+                answer = str((output.get("output", "") if isinstance(output, dict) else output) or "")
+                self.ai_log[-1] = self.format_ai_text(answer)
+        return answer
 
     def format_ai_text(self, text: str) -> str:
-        ts = datetime.now().strftime('%H:%M:%S')
+        ts = _ts()
         text = text.strip()
+        # 单行内容无需逐行规整
+        if text and "\n" not in text:
+            return f"[AI {ts}]\n{text}\n\n"
         # 轻度规整：去除长空行、统一换行
         lines = [l.rstrip() for l in text.splitlines()]
         if not lines:
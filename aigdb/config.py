@@ -1,8 +1,12 @@
+import hashlib
 import os
+import httpx
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from langchain_openai import ChatOpenAI
+from langchain_core.globals import set_llm_cache
+from langchain_community.cache import InMemoryCache, SQLiteCache
 
 # 加载环境变量
 load_dotenv()
@@ -11,6 +15,114 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.deepseek.com/v1")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "deepseek-chat")
+# LLM响应缓存（SQLite），temperature=0时相同提示可直接命中
+AIGDB_CACHE_DB = os.getenv("AIGDB_CACHE_DB", ".aigdb_llm_cache.db")
+# 可选语义缓存（GPTCache）：仅用于自然语言提问入口，改写措辞的相同问题也能命中；
+# 需额外安装gptcache、faiss-cpu与onnxruntime。智能体工具循环内的LLM调用只走精确匹配缓存
+AIGDB_SEMANTIC_CACHE = os.getenv("AIGDB_SEMANTIC_CACHE") == "1"
+AIGDB_SEMANTIC_CACHE_DIR = os.getenv("AIGDB_SEMANTIC_CACHE_DIR", ".aigdb_semantic_cache")
+
+_llm_cache_installed = False
+# 共享HTTP/2连接池：智能体多轮工具循环复用TCP+TLS连接，避免每步重新握手
+_HTTPX_LIMITS = httpx.Limits(max_keepalive_connections=16, max_connections=32)
+_HTTPX = httpx.AsyncClient(http2=True, timeout=60.0, limits=_HTTPX_LIMITS)
+_HTTPX_SYNC = httpx.Client(http2=True, timeout=60.0, limits=_HTTPX_LIMITS)
+# 语义缓存：按(exe_path, core_path)分区的GPTCache实例；_semantic_embedding为None表示未启用或依赖缺失
+_semantic_caches: Dict[str, Any] = {}
+_semantic_embedding: Optional[Any] = None
+
+
+def _init_semantic_embedding() -> None:
+    """预先导入GPTCache及faiss/onnx依赖并加载嵌入模型，任一缺失则静默关闭语义缓存。"""
+    global _semantic_embedding
+    if not AIGDB_SEMANTIC_CACHE:
+        return
+    try:
+        import faiss  # noqa: F401
+        import onnxruntime  # noqa: F401
+        from gptcache.embedding import Onnx
+
+        _semantic_embedding = Onnx()
+    except Exception:
+        _semantic_embedding = None
+
+
+def _get_semantic_cache(scope: str) -> Optional[Any]:
+    if _semantic_embedding is None:
+        return None
+    cache_obj = _semantic_caches.get(scope)
+    if cache_obj is None:
+        from gptcache import Cache
+        from gptcache.manager import manager_factory
+        from gptcache.processor.pre import get_prompt
+        from gptcache.similarity_evaluation.distance import SearchDistanceEvaluation
+
+        # 每个exe/core独立目录，相似路径的嵌入再接近也不会串用回答
+        hashed = hashlib.sha256(scope.encode()).hexdigest()[:16]
+        cache_obj = Cache()
+        cache_obj.init(
+            pre_embedding_func=get_prompt,
+            embedding_func=_semantic_embedding.to_embeddings,
+            data_manager=manager_factory(
+                "sqlite,faiss",
+                data_dir=os.path.join(AIGDB_SEMANTIC_CACHE_DIR, hashed),
+                vector_params={"dimension": _semantic_embedding.dimension},
+            ),
+            similarity_evaluation=SearchDistanceEvaluation(),
+        )
+        _semantic_caches[scope] = cache_obj
+    return cache_obj
+
+
+def semantic_scope(exe_path: Optional[str], core_path: Optional[str]) -> Optional[str]:
+    """语义缓存分区键：exe/core路径加core的mtime与大小，同路径覆盖写入的新core不会命中旧回答。
+    未加载exe/core或core不可访问时返回None，表示不使用语义缓存。
+    """
+    if not exe_path or not core_path:
+        return None
+    try:
+        st = os.stat(core_path)
+    except OSError:
+        return None
+    return f"{exe_path}|{core_path}|{st.st_mtime_ns}|{st.st_size}"
+
+
+def semantic_lookup(scope: str, question: str) -> Optional[str]:
+    """按用户原始提问查询语义缓存；未启用或未命中返回None。"""
+    cache_obj = _get_semantic_cache(scope)
+    if cache_obj is None:
+        return None
+    from gptcache.adapter.api import get
+
+    return get(question, cache_obj=cache_obj)
+
+
+def semantic_store(scope: str, question: str, answer: str) -> None:
+    # AgentExecutor提前终止时返回的占位文本不是回答，不入缓存
+    if not answer or answer.startswith("Agent stopped due to"):
+        return
+    cache_obj = _get_semantic_cache(scope)
+    if cache_obj is None:
+        return
+    from gptcache.adapter.api import put
+
+    put(question, answer, cache_obj=cache_obj)
+
+
+def _install_llm_cache() -> None:
+    """安装进程级LLM缓存，只初始化一次；SQLite路径不可写时回退到内存缓存。"""
+    global _llm_cache_installed
+    if _llm_cache_installed:
+        return
+    try:
+        set_llm_cache(SQLiteCache(database_path=AIGDB_CACHE_DB))
+    except Exception:
+        set_llm_cache(InMemoryCache())
+    _llm_cache_installed = True
+
+
+_install_llm_cache()
+_init_semantic_embedding()
 
 
 def get_llm() -> ChatOpenAI:
@@ -19,8 +131,14 @@ def get_llm() -> ChatOpenAI:
         raise RuntimeError(
             "未设置OPENAI_API_KEY，请在.env或环境变量中配置。"
         )
-    kwargs = {"model": OPENAI_MODEL, "temperature": 0}
+    # 开启流式输出，便于CLI逐token刷新AI面板
+    kwargs = {"model": OPENAI_MODEL, "temperature": 0, "streaming": True}
     # 指定兼容的Base URL
     if OPENAI_BASE_URL:
         kwargs["base_url"] = OPENAI_BASE_URL
-    return ChatOpenAI(api_key=OPENAI_API_KEY, **kwargs)
\ No newline at end of file
+    return ChatOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_async_client=_HTTPX,
+        http_client=_HTTPX_SYNC,
+        **kwargs,
+    )
\ No newline at end of file
@@ -1,6 +1,26 @@
+import asyncio
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
 from typing import List, Dict, Optional, Tuple
 from pygdbmi.gdbcontroller import GdbController
 
+# 会清空或改变当前exe/core上下文的GDB命令；按整词匹配，避免误伤如 runner 之类的表达式
+DANGEROUS_CLI_RE = re.compile(
+    r"^(file|core-file|symbol-file|exec-file|target|attach|run|quit)\b", re.IGNORECASE
+)
+_CLI_IN_MI_RE = re.compile(r'^-?interpreter-exec console "(.*)"$', re.DOTALL)
+
+
+def changes_target(mi_cmd: str) -> bool:
+    """判断MI命令（含interpreter-exec包装的CLI命令）是否可能改变目标文件。"""
+    if mi_cmd.startswith(("-file-", "-target-")):
+        return True
+    m = _CLI_IN_MI_RE.match(mi_cmd)
+    return bool(m and DANGEROUS_CLI_RE.match(m.group(1).strip()))
+
 
 class GDBController:
     """使用GDB/MI驱动gdb以实现可编程控制与输出采集。
@@ -10,6 +30,8 @@ class GDBController:
     - 提供常用操作封装：加载core、线程信息、调用栈、打印表达式等。
     """
 
+    VERIFY_TTL_SEC: float = 2.0
+
     def __init__(self, gdb_path: str = "gdb") -> None:
         try:
             # 使用MI2以匹配当前实现与pygdbmi解析
@@ -24,57 +46,196 @@ class GDBController:
         self.loaded: bool = False
         self.exe_path: Optional[str] = None
         self.core_path: Optional[str] = None
+        # verify_loaded结果缓存：(monotonic时间戳, 结果)，短时间内重复校验直接复用
+        self._verify_cache: Optional[Tuple[float, bool]] = None
+        # 已加载core期间基本不变的查询结果，键含exe/core路径，切换目标时清空
+        self._static_cache: Dict[str, str] = {}
+        # 后台I/O线程独占pygdbmi：队列元素为(命令列表, 超时, 对应future列表)，None表示退出
+        self._next_token: int = 1
+        self._queue: "queue.Queue[Optional[Tuple[List[str], float, List[Future]]]]" = queue.Queue()
+        self._io_thread = threading.Thread(target=self._io_loop, daemon=True)
+        self._io_thread.start()
 
     # --- 基础MI交互 ---
+    # 所有pygdbmi读写都在后台I/O线程中完成：同步调用阻塞等待future，异步调用await包装后的future，
+    # 避免长耗时GDB操作冻结prompt_toolkit事件循环。
+    def _submit(self, cmds: List[str], timeout_sec: float) -> List[Future]:
+        # 可能改变目标文件的命令使校验缓存失效
+        if any(changes_target(c) for c in cmds):
+            self._verify_cache = None
+            self._static_cache.clear()
+        futs: List[Future] = [Future() for _ in cmds]
+        self._queue.put((cmds, timeout_sec, futs))
+        return futs
+
     def write_mi(self, mi_cmd: str, timeout_sec: float = 5.0) -> List[Dict]:
-        return self._gdb.write(mi_cmd, timeout_sec=timeout_sec)
+        return self._submit([mi_cmd], timeout_sec)[0].result()
 
-    def write_cli(self, cli_cmd: str, timeout_sec: float = 5.0) -> List[Dict]:
+    async def awrite_mi(self, mi_cmd: str, timeout_sec: float = 5.0) -> List[Dict]:
+        return await asyncio.wrap_future(self._submit([mi_cmd], timeout_sec)[0])
+
+    @staticmethod
+    def cli_to_mi(cli_cmd: str) -> str:
         # 使用interpreter-exec运行原生CLI命令
-        cmd = f'interpreter-exec console "{cli_cmd}"'
-        return self.write_mi(cmd, timeout_sec)
+        return f'interpreter-exec console "{cli_cmd}"'
+
+    def write_cli(self, cli_cmd: str, timeout_sec: float = 5.0) -> List[Dict]:
+        return self.write_mi(self.cli_to_mi(cli_cmd), timeout_sec)
+
+    async def awrite_cli(self, cli_cmd: str, timeout_sec: float = 5.0) -> List[Dict]:
+        return await self.awrite_mi(self.cli_to_mi(cli_cmd), timeout_sec)
+
+    def write_mi_batch(self, cmds: List[str], timeout_sec: float = 5.0) -> List[List[Dict]]:
+        """一次提交多条MI命令，由I/O线程合并为一次带token的写入，返回与cmds一一对应的响应列表。"""
+        return [f.result() for f in self._submit(cmds, timeout_sec)]
+
+    async def awrite_mi_batch(self, cmds: List[str], timeout_sec: float = 5.0) -> List[List[Dict]]:
+        return list(await asyncio.gather(*map(asyncio.wrap_future, self._submit(cmds, timeout_sec))))
+
+    def _io_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            # 合并队列中已积压的请求，一次写入、按token拆分，减少逐条往返的IPC唤醒
+            cmds, futs = list(item[0]), list(item[2])
+            timeouts = [item[1]] * len(cmds)
+            while True:
+                try:
+                    more = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    self._queue.put(None)
+                    break
+                cmds += more[0]
+                timeouts += [more[1]] * len(more[0])
+                futs += more[2]
+            try:
+                results = self._write_tagged(cmds, timeouts)
+            except Exception as e:
+                for f in futs:
+                    f.set_exception(e)
+                continue
+            for f, res in zip(futs, results):
+                f.set_result(res)
+
+    def _write_tagged(self, cmds: List[str], timeouts: List[float]) -> List[List[Dict]]:
+        """仅在I/O线程中调用：写入带token的命令并读取到全部结果记录或超时为止。
+        GDB按序执行，超时按命令计：每收到一条结果记录，即以下一条未完成命令自身的超时重新计时。
+        旧版pygdbmi不支持read_response时回退到逐条阻塞写入。
+        """
+        tokens = list(range(self._next_token, self._next_token + len(cmds)))
+        self._next_token += len(cmds)
+        try:
+            self._gdb.write("\n".join(f"{t}{c}" for t, c in zip(tokens, cmds)), read_response=False)
+        except TypeError:
+            return [self._gdb.write(c, timeout_sec=t) for c, t in zip(cmds, timeouts)]
+        results: Dict[int, List[Dict]] = {t: [] for t in tokens}
+        untagged: List[Dict] = []
+        timeout_of = dict(zip(tokens, timeouts))
+
+        def next_pending() -> Optional[int]:
+            return next((t for t in tokens if not results[t]), None)
+
+        pending = next_pending()
+        deadline = time.monotonic() + timeout_of[tokens[0]]
+        while pending is not None and time.monotonic() < deadline:
+            responses = self._gdb.get_gdb_response(timeout_sec=0.2, raise_error_on_timeout=False)
+            done, untagged = self._demux(responses, untagged)
+            progressed = False
+            for token, batch in done:
+                if token in results:
+                    results[token] = batch
+                    progressed = True
+            pending = next_pending()
+            if progressed and pending is not None:
+                deadline = time.monotonic() + timeout_of[pending]
+        if untagged:
+            # 超时仍未收到结果记录的输出归入第一条未完成的命令
+            results[pending if pending is not None else tokens[-1]] += untagged
+        return [results[t] for t in tokens]
 
     @staticmethod
-    def format_responses(responses: List[Dict]) -> str:
-        lines: List[str] = []
+    def _demux(responses: List[Dict], untagged: List[Dict]) -> Tuple[List[Tuple[int, List[Dict]]], List[Dict]]:
+        """按token拆分响应。GDB顺序执行命令：无token的流输出归属于随后到达的带token结果记录。
+        返回(已完成的(token, 响应)列表, 尚未归属的输出)。
+        """
+        done: List[Tuple[int, List[Dict]]] = []
         for r in responses:
-            # 提取payload或message
-            payload = r.get("payload")
-            msg = r.get("message")
-            if isinstance(payload, dict):
-                lines.append(str(payload))
-            elif payload:
-                lines.append(str(payload))
-            elif msg:
-                lines.append(str(msg))
-        return "\n".join(lines) if lines else "(no output)"
+            token = r.get("token")
+            if r.get("type") != "result" or token is None:
+                untagged.append(r)
+                continue
+            done.append((token, untagged + [r]))
+            untagged = []
+        return done, untagged
+
+    @staticmethod
+    def format_responses(responses: List[Dict]) -> str:
+        # 提取payload或message；dict类型的payload即使为空也保留输出
+        parts = [
+            p if isinstance(p, str) else str(p)
+            for p in (
+                r.get("payload") if isinstance(r.get("payload"), dict) or r.get("payload") else r.get("message")
+                for r in responses
+            )
+            if isinstance(p, dict) or p
+        ]
+        return "\n".join(parts) if parts else "(no output)"
 
     # --- 高层封装 ---
     def load_core(self, exe_path: str, core_path: str) -> str:
+        self._verify_cache = None
+        self._static_cache.clear()
         self.exe_path = exe_path
         self.core_path = core_path
-        out1 = self.write_mi(f"-file-exec-and-symbols {exe_path}")
-        out2 = self.write_mi(f"-target-select core {core_path}")
+        out1, out2 = self.write_mi_batch([
+            f"-file-exec-and-symbols {exe_path}",
+            f"-target-select core {core_path}",
+        ])
         # 根据当前状态校验是否加载成功
         self.loaded = self.verify_loaded()
         return self.format_responses(out1 + out2)
 
-    def thread_info(self) -> str:
-        res = self.write_mi("-thread-info")
-        return self.format_responses(res)
+    # 同步与异步采集共用的命令列表：整组作为一批提交，避免其他调用方的命令插入其间
+    @staticmethod
+    def _thread_info_cmds() -> List[str]:
+        return ["-thread-info"]
 
-    def stack_list_frames(self, thread_id: Optional[int] = None) -> str:
+    @staticmethod
+    def _stack_frames_cmds(thread_id: Optional[int]) -> List[str]:
         # 选择线程后列出栈帧
-        outputs: List[Dict] = []
+        cmds: List[str] = []
         if thread_id is not None:
-            outputs += self.write_mi(f"-thread-select {thread_id}")
-        outputs += self.write_mi("-stack-list-frames")
-        return self.format_responses(outputs)
+            cmds.append(f"-thread-select {thread_id}")
+        cmds.append("-stack-list-frames")
+        return cmds
 
-    def stack_list_locals(self, all_values: bool = True) -> str:
+    @staticmethod
+    def _stack_locals_cmds(all_values: bool) -> List[str]:
         flag = "--all-values" if all_values else "--no-values"
-        res = self.write_mi(f"-stack-list-variables {flag}")
-        return self.format_responses(res)
+        return [f"-stack-list-variables {flag}"]
+
+    @classmethod
+    def _signal_summary_cmds(cls) -> List[str]:
+        # 尝试通过CLI获取信号与停止原因
+        return [cls.cli_to_mi("info signal"), cls.cli_to_mi("info program")]
+
+    def _query(self, cmds: List[str]) -> str:
+        return self.format_responses([r for res in self.write_mi_batch(cmds) for r in res])
+
+    async def _aquery(self, cmds: List[str]) -> str:
+        return self.format_responses([r for res in await self.awrite_mi_batch(cmds) for r in res])
+
+    def thread_info(self) -> str:
+        return self._query(self._thread_info_cmds())
+
+    def stack_list_frames(self, thread_id: Optional[int] = None) -> str:
+        return self._query(self._stack_frames_cmds(thread_id))
+
+    def stack_list_locals(self, all_values: bool = True) -> str:
+        return self._query(self._stack_locals_cmds(all_values))
 
     def print_expr(self, expr: str) -> str:
         res = self.write_cli(f"print {expr}")
@@ -84,16 +245,30 @@ class GDBController:
         res = self.write_cli(cmd)
         return self.format_responses(res)
 
+    async def arun_cli(self, cmd: str) -> str:
+        return self.format_responses(await self.awrite_cli(cmd))
+
     def get_signal_summary(self) -> str:
-        # 尝试通过CLI获取信号与停止原因
-        res = self.write_cli("info signal") + self.write_cli("info program")
-        return self.format_responses(res)
+        return self._query(self._signal_summary_cmds())
+
+    async def thread_info_async(self) -> str:
+        return await self._aquery(self._thread_info_cmds())
+
+    async def stack_list_frames_async(self, thread_id: Optional[int] = None) -> str:
+        return await self._aquery(self._stack_frames_cmds(thread_id))
+
+    async def stack_list_locals_async(self, all_values: bool = True) -> str:
+        return await self._aquery(self._stack_locals_cmds(all_values))
+
+    async def get_signal_summary_async(self) -> str:
+        return await self._aquery(self._signal_summary_cmds())
 
     def quit(self) -> None:
         try:
             self.write_mi("-gdb-exit")
         except Exception:
             pass
+        self._queue.put(None)
     # --- 进阶分析能力 ---
     def select_thread(self, thread_id: int) -> str:
         res = self.write_mi(f"-thread-select {thread_id}")
@@ -121,13 +296,23 @@ class GDBController:
         res = self.write_cli(f"x/{count}{fmt} {addr}")
         return self.format_responses(res)
 
+    def _cached_cli(self, cli_cmd: str) -> str:
+        # 仅缓存成功完成（收到^done结果记录）且有输出的结果；超时或空输出下次重新查询
+        key = f"{self.exe_path}|{self.core_path}|{cli_cmd}"
+        value = self._static_cache.get(key)
+        if value is None:
+            res = self.write_cli(cli_cmd)
+            value = self.format_responses(res)
+            done = any(r.get("type") == "result" and r.get("message") == "done" for r in res)
+            if done and value != "(no output)":
+                self._static_cache[key] = value
+        return value
+
     def info_files(self) -> str:
-        res = self.write_cli("info files")
-        return self.format_responses(res)
+        return self._cached_cli("info files")
 
     def info_sharedlibrary(self) -> str:
-        res = self.write_cli("info sharedlibrary")
-        return self.format_responses(res)
+        return self._cached_cli("info sharedlibrary")
 
     def bt_full(self) -> str:
         res = self.write_cli("bt full")
@@ -145,8 +330,16 @@ class GDBController:
     def verify_loaded(self) -> bool:
         """粗略校验是否仍处于已加载的core上下文。
         依据：`info files`输出中若包含“No executable file now.”或“No symbol file now.”则视为未加载。
-        只做轻量启发式检查，避免引入复杂解析。
+        只做轻量启发式检查，避免引入复杂解析；结果在VERIFY_TTL_SEC内复用，避免每次工具调用都执行`info files`。
         """
+        now = time.monotonic()
+        if self._verify_cache is not None and now - self._verify_cache[0] < self.VERIFY_TTL_SEC:
+            return self._verify_cache[1]
+        ok = self._verify_loaded_uncached()
+        self._verify_cache = (time.monotonic(), ok)
+        return ok
+
+    def _verify_loaded_uncached(self) -> bool:
         try:
             out = self.run_cli("info files")
         except Exception:
@@ -160,8 +353,12 @@ class GDBController:
         """在已记录exe/core的前提下，重新应用到当前会话。返回GDB的输出。"""
         if not self.exe_path or not self.core_path:
             return "(no recorded exe/core to reapply)"
-        out1 = self.write_mi(f"-file-exec-and-symbols {self.exe_path}")
-        out2 = self.write_mi(f"-target-select core {self.core_path}")
+        self._verify_cache = None
+        self._static_cache.clear()
+        out1, out2 = self.write_mi_batch([
+            f"-file-exec-and-symbols {self.exe_path}",
+            f"-target-select core {self.core_path}",
+        ])
         # 重新校验真实加载状态
         self.loaded = self.verify_loaded()
         return self.format_responses(out1 + out2)
\ No newline at end of file